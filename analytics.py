@@ -0,0 +1,296 @@
+"""Funnel analytics for the UPAK bot.
+
+Handlers call ``FunnelTracker.track`` which only appends a tuple to an in-memory
+ring buffer. A background task drains the buffer in batches into SQLite or a
+Redis stream, so the handler path never waits on storage.
+
+Conversion report from the configured backend:
+
+    python analytics.py report --db data/analytics.db
+    python analytics.py report --backend redis
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any
+
+
+logger = logging.getLogger("upak-bot.analytics")
+
+FUNNEL_STEPS = ("preview_started", "preview_created", "payment_started", "payment_created")
+
+Event = tuple[float, int, str, str | None]
+
+REDIS_REPORT_CHUNK = 10_000
+
+
+class SQLiteSink:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS funnel_events ("
+                "ts REAL NOT NULL, user_id INTEGER NOT NULL, event TEXT NOT NULL, package TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS funnel_events_event ON funnel_events (event, user_id)")
+        return self._conn
+
+    def _write(self, batch: list[Event]) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT INTO funnel_events (ts, user_id, event, package) VALUES (?, ?, ?, ?)", batch)
+
+    async def write(self, batch: list[Event]) -> None:
+        await asyncio.to_thread(self._write, batch)
+
+    async def report(self, since: float | None = None) -> dict[str, Any] | None:
+        return await asyncio.to_thread(funnel_report, self.path, since)
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RedisStreamSink:
+    def __init__(self, url: str, stream: str = "upak:funnel", maxlen: int = 1_000_000) -> None:
+        import redis.asyncio as aioredis
+
+        self.stream = stream
+        self.maxlen = maxlen
+        self._redis = aioredis.from_url(url)
+
+    async def write(self, batch: list[Event]) -> None:
+        pipe = self._redis.pipeline(transaction=False)
+        for ts, user_id, event, package in batch:
+            fields = {"ts": ts, "user_id": user_id, "event": event, "package": package or ""}
+            pipe.xadd(self.stream, fields, maxlen=self.maxlen, approximate=True)
+        await pipe.execute()
+
+    async def report(self, since: float | None = None) -> dict[str, Any]:
+        users: dict[str, set[int]] = {}
+        package_users: dict[tuple[str, str], set[int]] = {}
+        start = f"{int(since * 1000)}-0" if since is not None else "-"
+        while True:
+            entries = await self._redis.xrange(self.stream, min=start, max="+", count=REDIS_REPORT_CHUNK)
+            for entry_id, fields in entries:
+                event = fields[b"event"].decode()
+                user_id = int(fields[b"user_id"])
+                package = fields.get(b"package", b"").decode()
+                users.setdefault(event, set()).add(user_id)
+                if package:
+                    package_users.setdefault((event, package), set()).add(user_id)
+            if len(entries) < REDIS_REPORT_CHUNK:
+                break
+            start = f"({entries[-1][0].decode()}"
+        return build_report(
+            {event: len(ids) for event, ids in users.items()},
+            {key: len(ids) for key, ids in package_users.items()},
+        )
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+class FunnelTracker:
+    def __init__(
+        self,
+        sink: SQLiteSink | RedisStreamSink | None,
+        capacity: int = 10_000,
+        batch_size: int = 500,
+        flush_interval: float = 2.0,
+    ) -> None:
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._buffer: deque[Event] = deque(maxlen=capacity)
+        self._task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls) -> "FunnelTracker":
+        return cls(
+            sink_from_env(),
+            capacity=int(os.getenv("ANALYTICS_BUFFER_SIZE", "10000")),
+            flush_interval=float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "2")),
+        )
+
+    def track(self, event: str, user_id: int, package: str | None = None) -> None:
+        if self.sink is None:
+            return
+        buffer = self._buffer
+        if len(buffer) == buffer.maxlen:
+            self.dropped += 1
+        buffer.append((time.time(), user_id, event, package))
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            buffer = self._buffer
+            while buffer and self.sink is not None:
+                batch = [buffer.popleft() for _ in range(min(self.batch_size, len(buffer)))]
+                try:
+                    await self.sink.write(batch)
+                except Exception:
+                    logger.exception("Failed to flush %s analytics events, will retry", len(batch))
+                    overflow = len(buffer) + len(batch) - buffer.maxlen
+                    if overflow > 0:
+                        self.dropped += overflow
+                        batch = batch[overflow:]
+                    buffer.extendleft(reversed(batch))
+                    return
+
+    async def report(self, since: float | None = None) -> dict[str, Any] | None:
+        if self.sink is None:
+            return None
+        await self.flush()
+        return await self.sink.report(since)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self.sink is not None and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self.sink is not None:
+            await self.sink.close()
+
+
+def sink_from_env(backend: str | None = None) -> SQLiteSink | RedisStreamSink | None:
+    backend = (backend or os.getenv("ANALYTICS_BACKEND", "sqlite")).lower()
+    if backend == "sqlite":
+        return SQLiteSink(os.getenv("ANALYTICS_DB_PATH", "data/analytics.db"))
+    if backend == "redis":
+        return RedisStreamSink(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            os.getenv("ANALYTICS_REDIS_STREAM", "upak:funnel"),
+        )
+    if backend == "off":
+        return None
+    raise RuntimeError(f"Unknown ANALYTICS_BACKEND: {backend}")
+
+
+def build_report(totals: dict[str, int], package_totals: dict[tuple[str, str], int]) -> dict[str, Any]:
+    steps = []
+    first = totals.get(FUNNEL_STEPS[0], 0)
+    previous = first
+    for step in FUNNEL_STEPS:
+        users = totals.get(step, 0)
+        steps.append(
+            {
+                "event": step,
+                "users": users,
+                "from_previous": users / previous if previous else 0.0,
+                "from_first": users / first if first else 0.0,
+            }
+        )
+        previous = users
+
+    packages: dict[str, dict[str, int]] = {}
+    for (event, package), users in package_totals.items():
+        if package and event in ("payment_started", "payment_created"):
+            packages.setdefault(package, {"payment_started": 0, "payment_created": 0})[event] = users
+    return {"steps": steps, "packages": packages}
+
+
+def funnel_report(path: str, since: float | None = None) -> dict[str, Any] | None:
+    """Conversion report from the SQLite sink, or None if there is no analytics database at ``path``."""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        return None
+    try:
+        where = "WHERE ts >= ?" if since is not None else ""
+        params: tuple[Any, ...] = (since,) if since is not None else ()
+        rows = conn.execute(
+            f"SELECT event, COALESCE(package, ''), COUNT(DISTINCT user_id) FROM funnel_events {where} "
+            "GROUP BY event, package",
+            params,
+        ).fetchall()
+        totals = dict(
+            conn.execute(f"SELECT event, COUNT(DISTINCT user_id) FROM funnel_events {where} GROUP BY event", params)
+        )
+    except sqlite3.DatabaseError:
+        return None
+    finally:
+        conn.close()
+    return build_report(totals, {(event, package): users for event, package, users in rows})
+
+
+def format_report(report: dict[str, Any]) -> str:
+    lines = ["Funnel conversion", ""]
+    for step in report["steps"]:
+        lines.append(
+            f"{step['event']:<16} {step['users']:>7}  "
+            f"{step['from_previous']:>6.1%} of previous  {step['from_first']:>6.1%} of first"
+        )
+    if report["packages"]:
+        lines.append("")
+        lines.append("Payments by package")
+        for package, counts in sorted(report["packages"].items()):
+            started = counts["payment_started"]
+            created = counts["payment_created"]
+            rate = created / started if started else 0.0
+            lines.append(f"{package:<16} {started:>7} -> {created:<7} {rate:>6.1%}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="UPAK funnel analytics")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="print funnel conversion rates")
+    report_parser.add_argument("--backend", default=os.getenv("ANALYTICS_BACKEND", "sqlite"))
+    report_parser.add_argument("--db", help="SQLite file, defaults to ANALYTICS_DB_PATH")
+    report_parser.add_argument("--days", type=float, help="only count events from the last N days")
+    args = parser.parse_args()
+
+    backend = args.backend.lower()
+    sink = SQLiteSink(args.db) if args.db and backend == "sqlite" else sink_from_env(backend)
+    if sink is None:
+        raise SystemExit("Analytics backend is off, nothing to report")
+    since = time.time() - args.days * 86400 if args.days else None
+
+    async def load() -> dict[str, Any] | None:
+        try:
+            return await sink.report(since)
+        finally:
+            await sink.close()
+
+    report = asyncio.run(load())
+    if report is None:
+        raise SystemExit(f"No analytics database at {sink.path}")
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк накладных расходов аналитики воронки на пути обработчика.
+
+Сравнивает FunnelTracker.track с пустым вызовом и время begin_preview
+с включенной и выключенной аналитикой.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from unittest.mock import AsyncMock, Mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("TELEGRAM_TOKEN", "test_token_123456")
+os.environ["ANALYTICS_BACKEND"] = "off"
+
+import bot
+from analytics import FunnelTracker, SQLiteSink
+
+EVENTS = 200_000
+HANDLER_CALLS = 20_000
+
+
+def per_call_us(started: float, calls: int) -> float:
+    return (time.perf_counter() - started) / calls * 1_000_000
+
+
+def bench_track() -> None:
+    tracker = FunnelTracker(Mock(), capacity=EVENTS)
+    started = time.perf_counter()
+    for user_id in range(EVENTS):
+        tracker.track("preview_started", user_id)
+    print(f"track():                 {per_call_us(started, EVENTS):.3f} us/event")
+
+
+async def bench_handler(tracker: FunnelTracker) -> float:
+    bot.analytics = tracker
+    update = Mock()
+    update.effective_user.id = 1
+    update.callback_query.edit_message_text = AsyncMock()
+    context = Mock()
+    context.user_data = {}
+    started = time.perf_counter()
+    for _ in range(HANDLER_CALLS):
+        await bot.begin_preview(update, context)
+    return per_call_us(started, HANDLER_CALLS)
+
+
+async def bench_flush(path: str) -> None:
+    tracker = FunnelTracker(SQLiteSink(path), capacity=EVENTS)
+    for user_id in range(EVENTS):
+        tracker.track("preview_started", user_id)
+    started = time.perf_counter()
+    await tracker.stop()
+    print(f"flush to SQLite:         {per_call_us(started, EVENTS):.3f} us/event (background task)")
+
+
+def main() -> None:
+    print(f"🚀 Бенчмарк аналитики: {EVENTS} событий, {HANDLER_CALLS} вызовов обработчика")
+    print("=" * 50)
+    bench_track()
+
+    baseline = asyncio.run(bench_handler(FunnelTracker(None)))
+    tracked = asyncio.run(bench_handler(FunnelTracker(Mock(), capacity=HANDLER_CALLS)))
+    print(f"begin_preview, off:      {baseline:.3f} us/call")
+    print(f"begin_preview, tracked:  {tracked:.3f} us/call")
+    print(f"overhead:                {tracked - baseline:.3f} us/call")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(bench_flush(os.path.join(tmp, "analytics.db")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк задержки одного нажатия callback-кнопки против локального фейкового Bot API.
+
+Фейковый API отвечает с задержкой FAKE_LATENCY, как сетевой round trip до Telegram.
+Сравнивает старый путь (answer, затем edit) с параллельным ответом, пропуском
+одинаковых правок и антидребезгом.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from unittest.mock import Mock
+
+from aiohttp import web
+from telegram import Bot, Update
+from telegram.request import HTTPXRequest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("TELEGRAM_TOKEN", "test_token_123456")
+os.environ["ANALYTICS_BACKEND"] = "off"
+
+import bot
+from analytics import FunnelTracker
+from fake_bot_api import FakeBotAPI
+
+TOKEN = "123:bench"
+TAPS = 200
+FAKE_LATENCY = 0.02
+
+
+class CallbackAPI(FakeBotAPI):
+    def __init__(self) -> None:
+        super().__init__(TOKEN)
+        self.calls: Counter[str] = Counter()
+
+    async def handle(self, method: str, payload: dict) -> web.Response:
+        self.calls[method] += 1
+        await asyncio.sleep(FAKE_LATENCY)
+        if method == "getMe":
+            return self.ok({"id": 1, "is_bot": True, "first_name": "UPAK", "username": "upak_bot"})
+        if method == "editMessageText":
+            return self.ok({"message_id": 10, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "ok"})
+        return self.ok(True)
+
+
+def make_tap(telegram_bot: Bot, number: int, data: str) -> Update:
+    payload = {
+        "update_id": number,
+        "callback_query": {
+            "id": str(number),
+            "from": {"id": 1, "is_bot": False, "first_name": "User"},
+            "chat_instance": "bench",
+            "data": data,
+            "message": {"message_id": 10, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "menu"},
+        },
+    }
+    return Update.de_json(payload, telegram_bot)
+
+
+async def sequential_tap(update: Update, context: Mock) -> None:
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(f"screen {update.update_id % 2}", parse_mode="HTML")
+
+
+async def run_scenario(api: CallbackAPI, telegram_bot: Bot, name: str, handler, buttons, debounce: float) -> None:
+    bot.screens = bot.ScreenCache(debounce=debounce)
+    context = Mock()
+    context.user_data = {}
+    before = sum(api.calls.values())
+    latencies = []
+    for number in range(TAPS):
+        update = make_tap(telegram_bot, number, buttons[number % len(buttons)])
+        started = time.perf_counter()
+        await handler(update, context)
+        latencies.append((time.perf_counter() - started) * 1000)
+    calls = (sum(api.calls.values()) - before) / TAPS
+    p95 = statistics.quantiles(latencies, n=20)[-1]
+    print(f"{name:<34} mean {statistics.mean(latencies):6.1f} ms  p95 {p95:6.1f} ms  {calls:.2f} API calls/tap")
+
+
+async def main() -> None:
+    api = CallbackAPI()
+    await api.start()
+    telegram_bot = Bot(TOKEN, base_url=f"{api.url}/bot", request=HTTPXRequest(connection_pool_size=8))
+    await telegram_bot.initialize()
+    bot.analytics = FunnelTracker(None)
+    print(f"🚀 Бенчмарк callback-кнопок: {TAPS} нажатий, задержка API {FAKE_LATENCY * 1000:.0f} ms")
+    print("=" * 50)
+    try:
+        await run_scenario(api, telegram_bot, "answer, then edit (old path)", sequential_tap, ["pricing"], 0)
+        await run_scenario(api, telegram_bot, "answer + edit concurrently", bot.handle_button, ["pricing", "how"], 0)
+        await run_scenario(api, telegram_bot, "same screen, edit skipped", bot.handle_button, ["pricing"], 0)
+        await run_scenario(api, telegram_bot, "rapid repeat taps, debounced", bot.handle_button, ["pricing"], 10)
+    finally:
+        await telegram_bot.shutdown()
+        await api.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,20 +1,29 @@
+import asyncio
 import html
 import logging
 import os
+import time
+from collections import OrderedDict
 from typing import Any
 
 import aiohttp
 from dotenv import load_dotenv
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message, Update
+from telegram.error import BadRequest
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
     CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters,
 )
 
+from analytics import FunnelTracker, format_report
+from campaign import AudienceStore
+
 
 load_dotenv()
 
@@ -22,6 +31,8 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 API_BASE_URL = os.getenv("UPAK_API_BASE_URL", "https://api.upak.space").rstrip("/")
 SITE_URL = os.getenv("UPAK_SITE_URL", "https://www.upak.space").rstrip("/")
 SUPPORT_URL = os.getenv("UPAK_SUPPORT_URL", "https://t.me/SellEasyBot")
+TAP_DEBOUNCE_SECONDS = float(os.getenv("UPAK_TAP_DEBOUNCE", "0.7"))
+ADMIN_IDS = {int(item) for item in os.getenv("UPAK_ADMIN_IDS", "").split(",") if item.strip()}
 
 if not TELEGRAM_TOKEN:
     raise RuntimeError("TELEGRAM_TOKEN is required")
@@ -70,11 +81,55 @@ PACKAGES: dict[str, dict[str, Any]] = {
 
 MARKETPLACES = ("Wildberries", "Ozon", "WB + Ozon", "Другая площадка")
 
+analytics = FunnelTracker.from_env()
+audience = AudienceStore.from_env()
+
+
+class ScreenCache:
+    """Hash of the last screen rendered into each message and its last button tap, LRU-bounded."""
+
+    def __init__(self, size: int = 10_000, debounce: float = TAP_DEBOUNCE_SECONDS) -> None:
+        self.size = size
+        self.debounce = debounce
+        self._screens: OrderedDict[tuple[int, int], int] = OrderedDict()
+        self._taps: OrderedDict[tuple[int, int], tuple[str, float]] = OrderedDict()
+
+    @staticmethod
+    def _put(store: OrderedDict, key: Any, value: Any, size: int) -> None:
+        store[key] = value
+        store.move_to_end(key)
+        if len(store) > size:
+            store.popitem(last=False)
+
+    def is_current(self, message: Message | None, digest: int) -> bool:
+        return message is not None and self._screens.get((message.chat_id, message.message_id)) == digest
+
+    def remember(self, message: Message | None, digest: int) -> None:
+        if message is not None:
+            self._put(self._screens, (message.chat_id, message.message_id), digest, self.size)
+
+    def is_repeat_tap(self, message: Message | None, data: str) -> bool:
+        if message is None or self.debounce <= 0:
+            return False
+        key = (message.chat_id, message.message_id)
+        now = time.monotonic()
+        last_data, last_time = self._taps.get(key, ("", 0.0))
+        self._put(self._taps, key, (data, now), self.size)
+        return last_data == data and now - last_time < self.debounce
+
+
+screens = ScreenCache()
+
 
 def esc(value: Any) -> str:
     return html.escape(str(value or ""), quote=False)
 
 
+def user_id_of(update: Update) -> int:
+    user = update.effective_user
+    return user.id if user else 0
+
+
 def main_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -85,6 +140,28 @@ def main_keyboard() -> InlineKeyboardMarkup:
     )
 
 
+def screen_digest(text: str, reply_markup: InlineKeyboardMarkup | None) -> int:
+    return hash((text, reply_markup))
+
+
+async def edit_screen(update: Update, text: str, reply_markup: InlineKeyboardMarkup | None = None) -> None:
+    query = update.callback_query
+    digest = screen_digest(text, reply_markup)
+    if screens.is_current(query.message, digest):
+        return
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode="HTML")
+    except BadRequest as exc:
+        if "message is not modified" not in str(exc).lower():
+            raise
+    screens.remember(query.message, digest)
+
+
+async def reply_screen(update: Update, text: str, reply_markup: InlineKeyboardMarkup | None = None) -> None:
+    message = await update.message.reply_html(text, reply_markup=reply_markup)
+    screens.remember(message, screen_digest(text, reply_markup))
+
+
 def pricing_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
@@ -121,9 +198,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Без обещаний топа и гарантированного роста продаж: даем понятную структуру и экономим время."
     )
     if update.message:
-        await update.message.reply_html(text, reply_markup=main_keyboard())
+        await reply_screen(update, text, main_keyboard())
     elif update.callback_query:
-        await update.callback_query.edit_message_text(text, reply_markup=main_keyboard(), parse_mode="HTML")
+        await edit_screen(update, text, main_keyboard())
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -134,7 +211,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/pricing - тарифы и оплата\n\n"
         "Для preview достаточно описать товар: что это, для какой площадки, основные характеристики."
     )
-    await update.message.reply_html(text, reply_markup=main_keyboard())
+    await reply_screen(update, text, main_keyboard())
 
 
 async def preview_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -148,6 +225,7 @@ async def pricing_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def begin_preview(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data.clear()
     context.user_data["flow"] = "preview_product"
+    analytics.track("preview_started", user_id_of(update))
     text = (
         "<b>Бесплатный preview</b>\n\n"
         "Пришлите описание товара одним сообщением. Например:\n"
@@ -155,9 +233,9 @@ async def begin_preview(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         "Я верну короткий пример: название, 3 преимущества и фрагмент описания."
     )
     if update.callback_query:
-        await update.callback_query.edit_message_text(text, parse_mode="HTML")
+        await edit_screen(update, text)
     else:
-        await update.message.reply_html(text)
+        await reply_screen(update, text)
 
 
 async def show_pricing(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -170,9 +248,9 @@ async def show_pricing(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     lines.append("Для оплаты выберите тариф. Нужен email для чека YooKassa.")
     text = "\n".join(lines)
     if update.callback_query:
-        await update.callback_query.edit_message_text(text, reply_markup=pricing_keyboard(), parse_mode="HTML")
+        await edit_screen(update, text, pricing_keyboard())
     else:
-        await update.message.reply_html(text, reply_markup=pricing_keyboard())
+        await reply_screen(update, text, pricing_keyboard())
 
 
 async def show_how(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -184,7 +262,7 @@ async def show_how(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "4. Для сложных товаров можно заказать ручную проверку специалистом.\n\n"
         "Важно: результат помогает подготовить карточку, но продажи зависят также от цены, фото, отзывов, рекламы и конкуренции."
     )
-    await update.callback_query.edit_message_text(text, reply_markup=main_keyboard(), parse_mode="HTML")
+    await edit_screen(update, text, main_keyboard())
 
 
 async def begin_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, package: str) -> None:
@@ -192,6 +270,7 @@ async def begin_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, pack
     context.user_data.clear()
     context.user_data["flow"] = "payment_email"
     context.user_data["package"] = package
+    analytics.track("payment_started", user_id_of(update), package)
     text = (
         f"<b>{esc(item['name'])}</b>\n"
         f"Цена: <b>{esc(item['price'])}</b>\n"
@@ -199,14 +278,23 @@ async def begin_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, pack
         f"{esc(item['description'])}\n\n"
         "Пришлите email для онлайн-чека и ссылки на оплату."
     )
-    await update.callback_query.edit_message_text(text, parse_mode="HTML")
+    await edit_screen(update, text)
 
 
 async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
-    await query.answer()
-
     data = query.data or ""
+    if screens.is_repeat_tap(query.message, data):
+        await query.answer()
+        return
+
+    results = await asyncio.gather(query.answer(), show_screen(update, context, data), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+async def show_screen(update: Update, context: ContextTypes.DEFAULT_TYPE, data: str) -> None:
     if data == "preview":
         await begin_preview(update, context)
     elif data == "pricing":
@@ -216,7 +304,7 @@ async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     elif data.startswith("buy:"):
         package = data.split(":", 1)[1]
         if package not in PACKAGES:
-            await query.edit_message_text("Тариф не найден. Откройте список тарифов заново.", reply_markup=main_keyboard())
+            await edit_screen(update, "Тариф не найден. Откройте список тарифов заново.", main_keyboard())
             return
         await begin_payment(update, context, package)
     elif data == "menu":
@@ -234,6 +322,7 @@ async def create_preview(update: Update, context: ContextTypes.DEFAULT_TYPE, pro
 
     await update.message.reply_text("Готовлю preview...")
     data = await api_post("/v2/preview", payload)
+    analytics.track("preview_created", user_id_of(update))
 
     advantages = data.get("advantages") or []
     advantages_text = "\n".join(f"- {esc(item)}" for item in advantages)
@@ -266,6 +355,7 @@ async def create_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, ema
 
     if not payment_url:
         raise RuntimeError("Payment URL is empty")
+    analytics.track("payment_created", user_id_of(update), package)
 
     text = (
         f"<b>Оплата {esc(item['name'])}</b>\n\n"
@@ -320,16 +410,44 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         )
 
 
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if user_id_of(update) not in ADMIN_IDS:
+        return
+    report = await analytics.report()
+    if report is None:
+        await update.message.reply_text("Аналитика выключена или база событий еще не создана.")
+        return
+    await update.message.reply_html(f"<pre>{esc(format_report(report))}</pre>")
+
+
+async def remember_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user:
+        audience.remember(update.effective_user.id)
+
+
+async def post_init(app: Application) -> None:
+    await analytics.start()
+    await audience.start()
+
+
+async def post_shutdown(app: Application) -> None:
+    await analytics.stop()
+    await audience.stop()
+
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.exception("Unhandled bot error: %s", context.error)
 
 
 def main() -> None:
-    app = ApplicationBuilder().token(TELEGRAM_TOKEN).build()
+    app = ApplicationBuilder().token(TELEGRAM_TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
+    app.add_handler(TypeHandler(Update, remember_user), group=-1)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("preview", preview_command))
     app.add_handler(CommandHandler("pricing", pricing_command))
+    if ADMIN_IDS:
+        app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(CallbackQueryHandler(handle_button))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
     app.add_error_handler(error_handler)
@@ -0,0 +1,447 @@
+"""Broadcast campaigns for announcing changes to every UPAK bot user.
+
+The audience is a SQLite ``WITHOUT ROWID`` table of user ids collected from all
+incoming updates. A campaign walks it in id-ordered segments, sends with
+adaptive concurrency under the Telegram rate limit and checkpoints after each
+segment, so a restarted campaign continues from the last finished segment
+(at most one segment may be re-sent after a crash). Recipients that still fail
+after all attempts are kept in ``campaign_failures`` for a later retry.
+
+    python campaign.py import-analytics --analytics-db data/analytics.db
+    python campaign.py send tariffs-2025 --text-file announcement.html
+    python campaign.py send tariffs-2025 --retry-failed
+    python campaign.py status tariffs-2025
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import aiohttp
+
+
+logger = logging.getLogger("upak-bot.campaign")
+
+UNREACHABLE_ERRORS = ("chat not found", "user is deactivated", "bot was blocked", "peer_id_invalid")
+
+
+@dataclass
+class CampaignProgress:
+    name: str
+    text: str
+    last_user_id: int = 0
+    delivered: int = 0
+    blocked: int = 0
+    failed: int = 0
+    status: str = "running"
+    elapsed: float = 0.0
+
+    @property
+    def processed(self) -> int:
+        return self.delivered + self.blocked + self.failed
+
+    @property
+    def throughput(self) -> float:
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.name}: {self.status}, processed {self.processed} "
+            f"(delivered {self.delivered}, blocked {self.blocked}, failed {self.failed}), "
+            f"{self.throughput:.1f} msg/s, last user id {self.last_user_id}"
+        )
+
+
+class AudienceStore:
+    def __init__(self, path: str, flush_interval: float = 5.0) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self._seen: set[int] = set()
+        self._pending: list[int] = []
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+
+    @classmethod
+    def from_env(cls) -> "AudienceStore":
+        return cls(os.getenv("UPAK_AUDIENCE_DB", "data/audience.db"))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS audience (user_id INTEGER PRIMARY KEY) WITHOUT ROWID")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS campaigns ("
+                "name TEXT PRIMARY KEY, text TEXT NOT NULL, last_user_id INTEGER NOT NULL, "
+                "delivered INTEGER NOT NULL, blocked INTEGER NOT NULL, failed INTEGER NOT NULL, "
+                "status TEXT NOT NULL, elapsed REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS campaign_failures ("
+                "name TEXT NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (name, user_id)) WITHOUT ROWID"
+            )
+        return self._conn
+
+    def remember(self, user_id: int) -> None:
+        if user_id in self._seen:
+            return
+        self._seen.add(user_id)
+        self._pending.append(user_id)
+
+    def add(self, user_ids: list[int]) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO audience (user_id) VALUES (?)", ((uid,) for uid in user_ids))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM audience").fetchone()[0]
+
+    def segment(self, after: int, size: int) -> list[int]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT user_id FROM audience WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, size)
+            )
+            return [row[0] for row in rows]
+
+    def load_campaign(self, name: str) -> CampaignProgress | None:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT name, text, last_user_id, delivered, blocked, failed, status, elapsed "
+                "FROM campaigns WHERE name = ?",
+                (name,),
+            ).fetchone()
+        return CampaignProgress(*row) if row else None
+
+    def failures(self, name: str) -> list[int]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT user_id FROM campaign_failures WHERE name = ? ORDER BY user_id", (name,)
+            )
+            return [row[0] for row in rows]
+
+    def save_campaign(
+        self,
+        progress: CampaignProgress,
+        failed_ids: Iterable[int] = (),
+        resolved_ids: Iterable[int] = (),
+    ) -> None:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO campaign_failures (name, user_id) VALUES (?, ?)",
+                    ((progress.name, uid) for uid in failed_ids),
+                )
+                conn.executemany(
+                    "DELETE FROM campaign_failures WHERE name = ? AND user_id = ?",
+                    ((progress.name, uid) for uid in resolved_ids),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO campaigns "
+                    "(name, text, last_user_id, delivered, blocked, failed, status, elapsed) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        progress.name,
+                        progress.text,
+                        progress.last_user_id,
+                        progress.delivered,
+                        progress.blocked,
+                        progress.failed,
+                        progress.status,
+                        progress.elapsed,
+                    ),
+                )
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self.add, batch)
+        except Exception:
+            self._seen.difference_update(batch)
+            logger.exception("Failed to store %s audience ids", len(batch))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit plus a global messages-per-second pace.
+
+    Every ``limit`` successful sends raise the limit by one; a 429 halves it and
+    pauses all senders for ``retry_after`` seconds.
+    """
+
+    def __init__(self, initial: int = 8, maximum: int = 64, rate: float | None = 25.0) -> None:
+        self.limit = initial
+        self.maximum = maximum
+        self.interval = 1 / rate if rate else 0.0
+        self._in_flight = 0
+        self._streak = 0
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            if loop.time() >= self._paused_until:
+                return
+
+    async def release(self, retry_after: float | None = None, ok: bool = True) -> None:
+        loop = asyncio.get_running_loop()
+        async with self._cond:
+            self._in_flight -= 1
+            if retry_after is not None:
+                if loop.time() >= self._paused_until:
+                    self.limit = max(1, self.limit // 2)
+                self._paused_until = max(self._paused_until, loop.time() + retry_after)
+                self._streak = 0
+            elif ok:
+                self._streak += 1
+                if self._streak >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._streak = 0
+            self._cond.notify_all()
+
+
+class CampaignEngine:
+    def __init__(
+        self,
+        store: AudienceStore,
+        token: str,
+        api_url: str = "https://api.telegram.org",
+        segment_size: int = 500,
+        max_concurrency: int = 64,
+        rate: float | None = 25.0,
+        max_attempts: int = 3,
+        max_flood_waits: int = 10,
+    ) -> None:
+        self.store = store
+        self.url = f"{api_url.rstrip('/')}/bot{token}/sendMessage"
+        self.segment_size = segment_size
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.max_attempts = max_attempts
+        self.max_flood_waits = max_flood_waits
+        self.limiter: AdaptiveLimiter | None = None
+
+    async def _deliver(self, session: aiohttp.ClientSession, user_id: int, text: str) -> str:
+        payload = {"chat_id": user_id, "text": text, "parse_mode": "HTML", "disable_web_page_preview": True}
+        attempts = 0
+        flood_waits = 0
+        while attempts < self.max_attempts:
+            await self.limiter.acquire()
+            try:
+                async with session.post(self.url, json=payload) as response:
+                    status = response.status
+                    data = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exc:
+                status, data = 0, {"description": str(exc)}
+
+            if status == 429:
+                retry_after = float((data.get("parameters") or {}).get("retry_after", 1))
+                await self.limiter.release(retry_after=retry_after)
+                flood_waits += 1
+                if flood_waits >= self.max_flood_waits:
+                    logger.warning("Campaign message to %s still rate limited after %s waits", user_id, flood_waits)
+                    return "failed"
+                continue
+
+            await self.limiter.release(ok=status == 200)
+            if status == 200 and data.get("ok"):
+                return "delivered"
+            description = str(data.get("description", "")).lower()
+            if status == 403 or any(error in description for error in UNREACHABLE_ERRORS):
+                return "blocked"
+            if 400 <= status < 500:
+                logger.warning("Campaign message to %s rejected: %s", user_id, description)
+                return "failed"
+            attempts += 1
+            if attempts < self.max_attempts:
+                await asyncio.sleep(0.5 * attempts)
+        return "failed"
+
+    async def _send_segment(
+        self, session: aiohttp.ClientSession, user_ids: list[int], text: str
+    ) -> dict[str, list[int]]:
+        results = await asyncio.gather(*(self._deliver(session, uid, text) for uid in user_ids))
+        outcome: dict[str, list[int]] = {"delivered": [], "blocked": [], "failed": []}
+        for user_id, result in zip(user_ids, results):
+            outcome[result].append(user_id)
+        return outcome
+
+    def _session(self) -> aiohttp.ClientSession:
+        self.limiter = AdaptiveLimiter(maximum=self.max_concurrency, rate=self.rate)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+
+    async def run(self, name: str, text: str | None = None) -> CampaignProgress:
+        progress = await asyncio.to_thread(self.store.load_campaign, name)
+        if progress is None:
+            if not text:
+                raise RuntimeError(f"Campaign {name} does not exist and no text was given")
+            progress = CampaignProgress(name=name, text=text)
+            await asyncio.to_thread(self.store.save_campaign, progress)
+        elif progress.status == "done":
+            return progress
+        else:
+            logger.info("Resuming campaign after user id %s", progress.last_user_id)
+
+        started = time.perf_counter()
+        elapsed_before = progress.elapsed
+        async with self._session() as session:
+            while True:
+                segment = await asyncio.to_thread(self.store.segment, progress.last_user_id, self.segment_size)
+                if not segment:
+                    break
+                outcome = await self._send_segment(session, segment, progress.text)
+                progress.delivered += len(outcome["delivered"])
+                progress.blocked += len(outcome["blocked"])
+                progress.failed += len(outcome["failed"])
+                progress.last_user_id = segment[-1]
+                progress.elapsed = elapsed_before + time.perf_counter() - started
+                await asyncio.to_thread(self.store.save_campaign, progress, outcome["failed"])
+                logger.info("%s, concurrency %s", progress.summary(), self.limiter.limit)
+
+        progress.status = "done"
+        progress.elapsed = elapsed_before + time.perf_counter() - started
+        await asyncio.to_thread(self.store.save_campaign, progress)
+        logger.info(progress.summary())
+        return progress
+
+    async def retry_failed(self, name: str) -> CampaignProgress:
+        progress = await asyncio.to_thread(self.store.load_campaign, name)
+        if progress is None:
+            raise RuntimeError(f"Campaign {name} does not exist")
+        user_ids = await asyncio.to_thread(self.store.failures, name)
+        logger.info("Retrying %s failed recipients of %s", len(user_ids), name)
+
+        started = time.perf_counter()
+        elapsed_before = progress.elapsed
+        async with self._session() as session:
+            for offset in range(0, len(user_ids), self.segment_size):
+                segment = user_ids[offset : offset + self.segment_size]
+                outcome = await self._send_segment(session, segment, progress.text)
+                resolved = outcome["delivered"] + outcome["blocked"]
+                progress.delivered += len(outcome["delivered"])
+                progress.blocked += len(outcome["blocked"])
+                progress.failed -= len(resolved)
+                progress.elapsed = elapsed_before + time.perf_counter() - started
+                await asyncio.to_thread(self.store.save_campaign, progress, (), resolved)
+                logger.info("%s, concurrency %s", progress.summary(), self.limiter.limit)
+        return progress
+
+
+def import_analytics(store: AudienceStore, analytics_db: str) -> int:
+    try:
+        conn = sqlite3.connect(f"file:{analytics_db}?mode=ro", uri=True)
+    except sqlite3.OperationalError:
+        raise RuntimeError(f"No analytics database at {analytics_db}") from None
+    try:
+        user_ids = [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM funnel_events WHERE user_id > 0")]
+    finally:
+        conn.close()
+    store.add(user_ids)
+    return len(user_ids)
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        level=os.getenv("LOG_LEVEL", "INFO"),
+    )
+
+    parser = argparse.ArgumentParser(description="UPAK broadcast campaigns")
+    parser.add_argument("--db", default=os.getenv("UPAK_AUDIENCE_DB", "data/audience.db"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import-analytics", help="add users from the funnel analytics database")
+    import_parser.add_argument("--analytics-db", default=os.getenv("ANALYTICS_DB_PATH", "data/analytics.db"))
+
+    send_parser = subparsers.add_parser("send", help="start or resume a campaign")
+    send_parser.add_argument("name")
+    send_parser.add_argument("--text-file", help="HTML message text; only needed for a new campaign")
+    send_parser.add_argument("--retry-failed", action="store_true", help="resend to recipients that failed before")
+    send_parser.add_argument("--rate", type=float, default=25.0, help="messages per second")
+    send_parser.add_argument("--max-concurrency", type=int, default=64)
+
+    status_parser = subparsers.add_parser("status", help="show campaign progress")
+    status_parser.add_argument("name")
+
+    args = parser.parse_args()
+    store = AudienceStore(args.db)
+
+    if args.command == "import-analytics":
+        print(f"Imported {import_analytics(store, args.analytics_db)} users, audience size {store.count()}")
+    elif args.command == "send":
+        token = os.getenv("TELEGRAM_TOKEN")
+        if not token:
+            raise RuntimeError("TELEGRAM_TOKEN is required")
+        text = None
+        if args.text_file:
+            with open(args.text_file, encoding="utf-8") as handle:
+                text = handle.read().strip()
+        engine = CampaignEngine(
+            store,
+            token,
+            api_url=os.getenv("TELEGRAM_API_URL", "https://api.telegram.org"),
+            max_concurrency=args.max_concurrency,
+            rate=args.rate,
+        )
+        if args.retry_failed:
+            print(asyncio.run(engine.retry_failed(args.name)).summary())
+        else:
+            print(asyncio.run(engine.run(args.name, text)).summary())
+    elif args.command == "status":
+        progress = store.load_campaign(args.name)
+        print(progress.summary() if progress else f"Campaign {args.name} not found")
+        if progress:
+            print(f"Failed recipients waiting for --retry-failed: {len(store.failures(args.name))}")
+        print(f"Audience size: {store.count()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Local stand-in for the Telegram Bot API used by tests and benchmarks.
+
+Subclasses implement ``handle(method, payload)`` for ``POST /bot<token>/<method>``.
+"""
+
+from typing import Any
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    def __init__(self, token: str) -> None:
+        self.token = token
+        self.runner: web.AppRunner | None = None
+        self.url = ""
+
+    async def handle(self, method: str, payload: dict[str, Any]) -> web.Response:
+        raise NotImplementedError
+
+    async def _dispatch(self, request: web.Request) -> web.Response:
+        if request.content_type == "application/json":
+            payload = await request.json()
+        else:
+            payload = dict(await request.post())
+        return await self.handle(request.match_info["method"], payload)
+
+    @staticmethod
+    def ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def error(status: int, description: str, **parameters: Any) -> web.Response:
+        body: dict[str, Any] = {"ok": False, "error_code": status, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=status)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post(f"/bot{self.token}/{{method}}", self._dispatch)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        self.url = f"http://127.0.0.1:{self.runner.addresses[0][1]}"
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Тесты аналитики воронки UPAK: буфер событий, сброс в SQLite и отчет по конверсии
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from unittest.mock import AsyncMock, Mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("TELEGRAM_TOKEN", "test_token_123456")
+os.environ["ANALYTICS_BACKEND"] = "off"
+
+from analytics import FunnelTracker, SQLiteSink, format_report, funnel_report
+
+
+def make_update(user_id: int) -> Mock:
+    update = Mock()
+    update.effective_user.id = user_id
+    update.effective_user.username = f"user{user_id}"
+    update.callback_query.edit_message_text = AsyncMock()
+    update.message.reply_text = AsyncMock()
+    update.message.reply_html = AsyncMock()
+    return update
+
+
+def make_context() -> Mock:
+    context = Mock()
+    context.user_data = {}
+    return context
+
+
+def test_flush_and_report():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "analytics.db")
+
+        async def scenario():
+            tracker = FunnelTracker(SQLiteSink(path), batch_size=3)
+            for user_id in range(10):
+                tracker.track("preview_started", user_id)
+                tracker.track("preview_started", user_id)
+            for user_id in range(5):
+                tracker.track("preview_created", user_id)
+            for user_id in range(4):
+                tracker.track("payment_started", user_id, "start")
+            tracker.track("payment_created", 0, "start")
+            tracker.track("payment_started", 9, "pro")
+            assert tracker.pending() == 31
+            await tracker.stop()
+            assert tracker.pending() == 0
+
+        asyncio.run(scenario())
+        report = funnel_report(path)
+
+    users = {step["event"]: step["users"] for step in report["steps"]}
+    assert users == {"preview_started": 10, "preview_created": 5, "payment_started": 5, "payment_created": 1}
+    assert report["steps"][1]["from_previous"] == 0.5
+    assert report["steps"][3]["from_first"] == 0.1
+    assert report["packages"]["start"] == {"payment_started": 4, "payment_created": 1}
+    assert report["packages"]["pro"] == {"payment_started": 1, "payment_created": 0}
+    assert "preview_started" in format_report(report)
+    print("✅ События сбрасываются в SQLite, конверсия считается по уникальным пользователям")
+
+
+def test_ring_buffer_drops_oldest():
+    tracker = FunnelTracker(Mock(), capacity=3)
+    for user_id in range(5):
+        tracker.track("preview_started", user_id)
+    assert tracker.pending() == 3
+    assert tracker.dropped == 2
+    assert [event[1] for event in tracker._buffer] == [2, 3, 4]
+    print("✅ Переполненный буфер вытесняет старые события")
+
+
+def test_disabled_tracker_records_nothing():
+    tracker = FunnelTracker(None)
+    tracker.track("preview_started", 1)
+    assert tracker.pending() == 0
+    print("✅ ANALYTICS_BACKEND=off не копит события")
+
+
+def test_report_on_missing_database():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "missing.db")
+        assert funnel_report(path) is None
+        assert not os.path.exists(path)
+    print("✅ Отчет без базы возвращает None и не создает файл")
+
+
+def test_failed_flush_keeps_events():
+    sink = Mock()
+    sink.write = AsyncMock(side_effect=[ConnectionError("redis is down"), None])
+    tracker = FunnelTracker(sink, capacity=5)
+    for user_id in range(3):
+        tracker.track("preview_started", user_id)
+
+    asyncio.run(tracker.flush())
+    assert tracker.pending() == 3
+    assert tracker.dropped == 0
+
+    tracker.track("preview_started", 3)
+    tracker.track("preview_started", 4)
+    asyncio.run(tracker.flush())
+    assert tracker.pending() == 0
+    assert [event[1] for event in sink.write.await_args.args[0]] == [0, 1, 2, 3, 4]
+    print("✅ Неудачный сброс возвращает события в буфер")
+
+
+def test_failed_flush_drops_only_overflow():
+    async def write(batch):
+        await asyncio.sleep(0.01)
+        raise ConnectionError("redis is down")
+
+    sink = Mock()
+    sink.write = AsyncMock(side_effect=write)
+    tracker = FunnelTracker(sink, capacity=4, batch_size=3)
+    for user_id in range(4):
+        tracker.track("preview_started", user_id)
+
+    async def scenario():
+        flush = asyncio.create_task(tracker.flush())
+        await asyncio.sleep(0)
+        tracker.track("preview_started", 4)
+        tracker.track("preview_started", 5)
+        await flush
+
+    asyncio.run(scenario())
+    assert tracker.dropped == 2
+    assert [event[1] for event in tracker._buffer] == [2, 3, 4, 5]
+    print("✅ При переполнении теряются только самые старые события")
+
+
+def test_concurrent_flushes_are_serialized():
+    writers = 0
+    max_writers = 0
+
+    async def write(batch):
+        nonlocal writers, max_writers
+        writers += 1
+        max_writers = max(max_writers, writers)
+        await asyncio.sleep(0.01)
+        writers -= 1
+
+    sink = Mock()
+    sink.write = AsyncMock(side_effect=write)
+    tracker = FunnelTracker(sink, batch_size=1)
+    for user_id in range(4):
+        tracker.track("preview_started", user_id)
+
+    async def scenario():
+        await asyncio.gather(tracker.flush(), tracker.flush())
+
+    asyncio.run(scenario())
+    assert max_writers == 1
+    assert sink.write.await_count == 4
+    print("✅ Параллельные сбросы не пишут одновременно")
+
+
+def test_redis_report_reads_stream():
+    from analytics import RedisStreamSink
+
+    sink = RedisStreamSink("redis://localhost:6379/0")
+    entries = [
+        (b"1-0", {b"event": b"preview_started", b"user_id": b"1", b"package": b""}),
+        (b"2-0", {b"event": b"preview_started", b"user_id": b"2", b"package": b""}),
+        (b"3-0", {b"event": b"preview_started", b"user_id": b"1", b"package": b""}),
+        (b"4-0", {b"event": b"payment_started", b"user_id": b"1", b"package": b"pro"}),
+    ]
+    sink._redis = Mock()
+    sink._redis.xrange = AsyncMock(return_value=entries)
+
+    report = asyncio.run(sink.report())
+    users = {step["event"]: step["users"] for step in report["steps"]}
+    assert users["preview_started"] == 2
+    assert users["payment_started"] == 1
+    assert report["packages"]["pro"] == {"payment_started": 1, "payment_created": 0}
+    print("✅ Отчет по Redis stream считается через XRANGE")
+
+
+def test_handlers_track_funnel():
+    import bot
+
+    tracker = FunnelTracker(Mock())
+    original_analytics, original_api_post = bot.analytics, bot.api_post
+    bot.analytics = tracker
+
+    async def scenario():
+        await bot.begin_preview(make_update(7), make_context())
+        await bot.begin_payment(make_update(7), make_context(), "pro")
+
+        bot.api_post = AsyncMock(return_value={"title": "Куртка", "advantages": ["Теплая"]})
+        await bot.create_preview(make_update(7), make_context(), "Женская куртка")
+
+        bot.api_post = AsyncMock(return_value={"payment_url": "https://pay.example", "order_id": "1"})
+        context = make_context()
+        context.user_data["package"] = "pro"
+        await bot.create_payment(make_update(7), context, "test@upak.space")
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        bot.analytics, bot.api_post = original_analytics, original_api_post
+    events = [(event[1], event[2], event[3]) for event in tracker._buffer]
+    assert events == [
+        (7, "preview_started", None),
+        (7, "payment_started", "pro"),
+        (7, "preview_created", None),
+        (7, "payment_created", "pro"),
+    ]
+    print("✅ Обработчики записывают шаги воронки")
+
+
+def test_stats_command_without_database():
+    import bot
+
+    with tempfile.TemporaryDirectory() as tmp:
+        original_analytics, original_admins = bot.analytics, bot.ADMIN_IDS
+        bot.analytics = FunnelTracker(SQLiteSink(os.path.join(tmp, "analytics.db")))
+        bot.ADMIN_IDS = {7}
+        update = make_update(7)
+        try:
+            asyncio.run(bot.stats_command(update, make_context()))
+        finally:
+            bot.analytics, bot.ADMIN_IDS = original_analytics, original_admins
+    update.message.reply_text.assert_awaited_once()
+    update.message.reply_html.assert_not_awaited()
+    print("✅ /stats без базы событий сообщает об этом, а не показывает нули")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов аналитики воронки")
+    print("=" * 50)
+    test_flush_and_report()
+    test_ring_buffer_drops_oldest()
+    test_disabled_tracker_records_nothing()
+    test_report_on_missing_database()
+    test_failed_flush_keeps_events()
+    test_failed_flush_drops_only_overflow()
+    test_concurrent_flushes_are_serialized()
+    test_redis_report_reads_stream()
+    test_handlers_track_funnel()
+    test_stats_command_without_database()
+    print("=" * 50)
+    print("🏁 Тестирование завершено")
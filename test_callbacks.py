@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Тесты быстрого пути callback-кнопок: параллельный ответ, пропуск одинаковых правок и антидребезг
+"""
+
+import asyncio
+import os
+import sys
+from unittest.mock import AsyncMock, Mock
+
+from telegram.error import BadRequest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("TELEGRAM_TOKEN", "test_token_123456")
+os.environ["ANALYTICS_BACKEND"] = "off"
+
+import bot
+from analytics import FunnelTracker
+
+
+def make_message(message_id: int = 10) -> Mock:
+    message = Mock()
+    message.chat_id = 1
+    message.message_id = message_id
+    return message
+
+
+def make_tap(data: str, message: Mock) -> Mock:
+    update = Mock()
+    update.effective_user.id = 1
+    update.callback_query.data = data
+    update.callback_query.message = message
+    update.callback_query.answer = AsyncMock()
+    update.callback_query.edit_message_text = AsyncMock()
+    return update
+
+
+def make_context() -> Mock:
+    context = Mock()
+    context.user_data = {}
+    return context
+
+
+def with_screens(debounce: float):
+    def decorator(test):
+        def wrapper():
+            original_screens, original_analytics = bot.screens, bot.analytics
+            bot.screens = bot.ScreenCache(debounce=debounce)
+            bot.analytics = FunnelTracker(Mock())
+            try:
+                test()
+            finally:
+                bot.screens, bot.analytics = original_screens, original_analytics
+
+        wrapper.__name__ = test.__name__
+        return wrapper
+
+    return decorator
+
+
+@with_screens(debounce=0)
+def test_answer_and_edit_run_concurrently():
+    async def scenario():
+        edited = asyncio.Event()
+        update = make_tap("how", make_message())
+
+        async def answer():
+            await asyncio.wait_for(edited.wait(), timeout=1)
+
+        async def edit(*args, **kwargs):
+            edited.set()
+
+        update.callback_query.answer = AsyncMock(side_effect=answer)
+        update.callback_query.edit_message_text = AsyncMock(side_effect=edit)
+        await bot.handle_button(update, make_context())
+
+    asyncio.run(scenario())
+    print("✅ answer() и правка экрана уходят параллельно")
+
+
+@with_screens(debounce=0)
+def test_identical_edit_is_skipped():
+    message = make_message()
+
+    async def scenario():
+        first = make_tap("pricing", message)
+        await bot.handle_button(first, make_context())
+        second = make_tap("pricing", message)
+        await bot.handle_button(second, make_context())
+        third = make_tap("how", message)
+        await bot.handle_button(third, make_context())
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert first.callback_query.edit_message_text.await_count == 1
+    assert second.callback_query.edit_message_text.await_count == 0
+    assert second.callback_query.answer.await_count == 1
+    assert third.callback_query.edit_message_text.await_count == 1
+    print("✅ Одинаковый экран не редактируется повторно")
+
+
+@with_screens(debounce=0)
+def test_sent_screen_is_remembered():
+    message = make_message(20)
+
+    async def scenario():
+        command = Mock()
+        command.callback_query = None
+        command.message.reply_html = AsyncMock(return_value=message)
+        await bot.pricing_command(command, make_context())
+        tap = make_tap("pricing", message)
+        await bot.handle_button(tap, make_context())
+        return tap
+
+    tap = asyncio.run(scenario())
+    assert tap.callback_query.edit_message_text.await_count == 0
+    print("✅ Экран, отправленный командой, тоже не редактируется повторно")
+
+
+@with_screens(debounce=0)
+def test_not_modified_error_is_ignored():
+    message = make_message()
+
+    async def scenario():
+        first = make_tap("how", message)
+        first.callback_query.edit_message_text = AsyncMock(
+            side_effect=BadRequest("Message is not modified: specified new message content and reply markup are exactly the same")
+        )
+        await bot.handle_button(first, make_context())
+        second = make_tap("how", message)
+        await bot.handle_button(second, make_context())
+        return second
+
+    second = asyncio.run(scenario())
+    assert second.callback_query.edit_message_text.await_count == 0
+    print("✅ Ошибка 'message is not modified' не считается сбоем")
+
+
+@with_screens(debounce=10)
+def test_repeat_taps_are_debounced():
+    message = make_message()
+
+    async def scenario():
+        taps = [make_tap(data, message) for data in ("preview", "preview", "how", "preview")]
+        for tap in taps:
+            await bot.handle_button(tap, make_context())
+        return taps
+
+    taps = asyncio.run(scenario())
+    assert all(tap.callback_query.answer.await_count == 1 for tap in taps)
+    events = [event[2] for event in bot.analytics._buffer]
+    assert events == ["preview_started", "preview_started"]
+    assert taps[1].callback_query.edit_message_text.await_count == 0
+    assert taps[3].callback_query.edit_message_text.await_count == 1
+    print("✅ Быстрые повторные нажатия той же кнопки только подтверждаются")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов callback-кнопок")
+    print("=" * 50)
+    test_answer_and_edit_run_concurrently()
+    test_identical_edit_is_skipped()
+    test_sent_screen_is_remembered()
+    test_not_modified_error_is_ignored()
+    test_repeat_taps_are_debounced()
+    print("=" * 50)
+    print("🏁 Тестирование завершено")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Тесты рассылок UPAK против локального фейкового Bot API на 100 000 получателей
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from campaign import AdaptiveLimiter, AudienceStore, CampaignEngine
+from fake_bot_api import FakeBotAPI
+
+RECIPIENTS = 100_000
+TOKEN = "123:test"
+
+
+class SendMessageAPI(FakeBotAPI):
+    """sendMessage с блокировками каждого 1000-го пользователя и периодическими 429."""
+
+    def __init__(self, flood_every: int = 7_000, crash_after: int | None = None) -> None:
+        super().__init__(TOKEN)
+        self.sent: Counter[int] = Counter()
+        self.failing: set[int] = set()
+        self.flooding: set[int] = set()
+        self.requests = 0
+        self.flood_every = flood_every
+        self.crash_after = crash_after
+        self.crashed = asyncio.Event()
+
+    async def handle(self, method: str, payload: dict) -> web.Response:
+        chat_id = payload["chat_id"]
+        self.requests += 1
+        if self.crash_after is not None and self.requests >= self.crash_after:
+            self.crashed.set()
+        if chat_id in self.failing:
+            return self.error(502, "Bad Gateway")
+        if self.requests % self.flood_every == 0 or chat_id in self.flooding:
+            return self.error(429, "Too Many Requests", retry_after=0.05)
+        if chat_id % 1000 == 0:
+            return self.error(403, "Forbidden: bot was blocked by the user")
+        self.sent[chat_id] += 1
+        return self.ok({"message_id": self.requests, "chat": {"id": chat_id}})
+
+
+def test_audience_store_deduplicates_and_segments():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AudienceStore(os.path.join(tmp, "audience.db"))
+
+        async def scenario():
+            for user_id in (5, 3, 5, 9, 3, 1):
+                store.remember(user_id)
+            await store.flush()
+            store.remember(3)
+            await store.flush()
+
+        asyncio.run(scenario())
+        assert store.count() == 4
+        assert store.segment(0, 2) == [1, 3]
+        assert store.segment(3, 10) == [5, 9]
+        asyncio.run(store.stop())
+    print("✅ Аудитория хранит уникальные id и отдает их сегментами")
+
+
+def test_limiter_backs_off_on_flood():
+    async def scenario():
+        limiter = AdaptiveLimiter(initial=8, maximum=16, rate=None)
+        for _ in range(16):
+            await limiter.acquire()
+            await limiter.release()
+        assert limiter.limit == 9
+
+        await limiter.acquire()
+        await limiter.acquire()
+        await limiter.release(retry_after=0.1)
+        await limiter.release(retry_after=0.1)
+        assert limiter.limit == 4
+
+        started = time.perf_counter()
+        await limiter.acquire()
+        assert time.perf_counter() - started >= 0.09
+        await limiter.release()
+
+    asyncio.run(scenario())
+    print("✅ Лимитер растит параллельность и уменьшает ее вдвое на 429")
+
+
+def test_campaign_resumes_after_crash():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AudienceStore(os.path.join(tmp, "audience.db"))
+        store.add(list(range(1, RECIPIENTS + 1)))
+        segment_size = 1000
+
+        async def scenario():
+            api = SendMessageAPI(crash_after=RECIPIENTS // 2)
+            await api.start()
+            try:
+                engine = CampaignEngine(store, TOKEN, api_url=api.url, segment_size=segment_size, rate=None)
+                task = asyncio.create_task(engine.run("tariffs", "<b>Новые тарифы</b>"))
+                await api.crashed.wait()
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+                interrupted = store.load_campaign("tariffs")
+                assert interrupted.status == "running"
+                assert 0 < interrupted.last_user_id < RECIPIENTS
+
+                engine = CampaignEngine(store, TOKEN, api_url=api.url, segment_size=segment_size, rate=None)
+                started = time.perf_counter()
+                progress = await engine.run("tariffs")
+                elapsed = time.perf_counter() - started
+            finally:
+                await api.stop()
+            return api, interrupted, progress, elapsed
+
+        api, interrupted, progress, elapsed = asyncio.run(scenario())
+        assert store.load_campaign("tariffs").status == "done"
+        asyncio.run(store.stop())
+
+    blocked = RECIPIENTS // 1000
+    assert progress.status == "done"
+    assert progress.delivered == RECIPIENTS - blocked
+    assert progress.blocked == blocked
+    assert progress.failed == 0
+    assert set(api.sent) == {uid for uid in range(1, RECIPIENTS + 1) if uid % 1000}
+    duplicates = sum(api.sent.values()) - len(api.sent)
+    assert duplicates <= segment_size
+
+    resumed = RECIPIENTS - interrupted.last_user_id
+    print(f"✅ Рассылка возобновилась после user id {interrupted.last_user_id}, повторов: {duplicates}")
+    print(f"   {progress.summary()}")
+    print(f"   После возобновления: {resumed} получателей за {elapsed:.1f} с ({resumed / elapsed:.0f} msg/s)")
+
+
+def test_failed_recipients_are_retried():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = AudienceStore(os.path.join(tmp, "audience.db"))
+        store.add(list(range(1, 51)))
+
+        async def scenario():
+            api = SendMessageAPI(flood_every=RECIPIENTS)
+            api.failing = {7, 8}
+            api.flooding = {13}
+            await api.start()
+            try:
+                engine = CampaignEngine(
+                    store, TOKEN, api_url=api.url, segment_size=20, rate=None, max_attempts=2, max_flood_waits=3
+                )
+                first = await engine.run("tariffs", "<b>Новые тарифы</b>")
+                failures = store.failures("tariffs")
+
+                api.failing.clear()
+                api.flooding.clear()
+                retried = await engine.retry_failed("tariffs")
+            finally:
+                await api.stop()
+            return api, first.failed, failures, retried
+
+        api, first_failed, failures, retried = asyncio.run(scenario())
+        assert first_failed == 3
+        assert failures == [7, 8, 13]
+        assert retried.failed == 0
+        assert retried.delivered == 50
+        assert store.failures("tariffs") == []
+        assert set(api.sent) == set(range(1, 51))
+        asyncio.run(store.stop())
+    print("✅ Недоставленные получатели сохраняются и досылаются через --retry-failed")
+
+
+if __name__ == "__main__":
+    print("🚀 Запуск тестов рассылок")
+    print("=" * 50)
+    test_audience_store_deduplicates_and_segments()
+    test_limiter_backs_off_on_flood()
+    test_failed_recipients_are_retried()
+    test_campaign_resumes_after_crash()
+    print("=" * 50)
+    print("🏁 Тестирование завершено")